@@ -0,0 +1,325 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+
+from models.database import BASE_DIR, DATABASE_PATH
+
+# Online backups of the SQLite ledger.
+#
+# Snapshots are taken with SQLite's online backup API a few pages at a time,
+# pausing between steps, so payments keep committing while a backup runs
+# (the database is in WAL mode, see models/database.py).
+#
+# A chain in BACKUP_DIR starts with a full snapshot and is followed by
+# incremental ones that only store the pages changed since the previous
+# snapshot:
+#   <stamp>.json          manifest (type, parent, page size/count, page hashes)
+#   <stamp>.full.db.gz    full snapshot
+#   <stamp>.pages.gz      incremental snapshot: (page number, page) records
+#
+# Usage:
+#   python -m logic.backup full
+#   python -m logic.backup incremental
+#   python -m logic.backup verify [stamp]
+#   python -m logic.backup restore <target.db> [stamp]
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", os.path.join(BASE_DIR, "../backups"))
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE_SECONDS = float(os.environ.get("BACKUP_STEP_PAUSE_MS", "5")) / 1000
+BACKUP_MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", "3"))
+
+_PAGE_RECORD = struct.Struct(">I")
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+# ----------------------
+# Online copy
+# ----------------------
+def online_copy(dest_path, source_path=DATABASE_PATH, pages_per_step=BACKUP_PAGES_PER_STEP,
+                pause=BACKUP_STEP_PAUSE_SECONDS, max_restarts=BACKUP_MAX_RESTARTS):
+    """
+    Copy the live database to dest_path without stopping the service
+
+    SQLite restarts a paced backup whenever another connection writes between
+    steps, so under steady payment traffic it may never finish. After
+    max_restarts the copy falls back to a single step: in WAL mode that only
+    holds a read snapshot, so writers still aren't blocked.
+
+    Returns copy stats: pages, seconds, pages_per_second, lock_seconds (total
+    time spent inside backup steps), max_lock_ms (longest single step),
+    restarts (times a concurrent write forced SQLite to start over) and
+    fallback (whether the single-step copy was needed).
+    """
+    stats = {"pages": 0, "lock_seconds": 0.0, "max_lock_ms": 0.0, "restarts": 0, "fallback": False}
+    last_remaining = None
+    step_started = time.perf_counter()
+
+    def record_step(held):
+        stats["lock_seconds"] += held
+        stats["max_lock_ms"] = max(stats["max_lock_ms"], held * 1000)
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining, step_started
+        record_step(time.perf_counter() - step_started)
+        stats["pages"] = total
+        if last_remaining is not None and remaining > last_remaining:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _TooManyRestarts()  # Aborts the paced backup
+        last_remaining = remaining
+        # Pause outside the step so writers get the database to themselves
+        if remaining and pause:
+            time.sleep(pause)
+        step_started = time.perf_counter()
+
+    source = sqlite3.connect(source_path)
+    started = time.perf_counter()
+    try:
+        dest = sqlite3.connect(dest_path)
+        try:
+            step_started = time.perf_counter()
+            source.backup(dest, pages=pages_per_step, progress=progress)
+        except _TooManyRestarts:
+            stats["fallback"] = True
+        finally:
+            dest.close()
+
+        if stats["fallback"]:
+            print(f"⚠️ [BACKUP] {stats['restarts']} restarts under concurrent writes, finishing in a single step")
+            os.remove(dest_path)
+            dest = sqlite3.connect(dest_path)
+            try:
+                step_started = time.perf_counter()
+                source.backup(dest, pages=-1)
+                record_step(time.perf_counter() - step_started)
+                stats["pages"] = dest.execute("PRAGMA page_count").fetchone()[0]
+            finally:
+                dest.close()
+    finally:
+        source.close()
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["pages_per_second"] = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+# ----------------------
+# Snapshot chain
+# ----------------------
+def _page_size(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _iter_pages(path, page_size):
+    with open(path, "rb") as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                return
+            yield page
+
+
+def _page_hash(page):
+    return hashlib.sha1(page).hexdigest()
+
+
+def _manifest_path(stamp):
+    return os.path.join(BACKUP_DIR, f"{stamp}.json")
+
+
+def _load_manifest(stamp):
+    with open(_manifest_path(stamp)) as f:
+        return json.load(f)
+
+
+def list_snapshots():
+    """Stamps of every snapshot in BACKUP_DIR, oldest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(BACKUP_DIR) if name.endswith(".json"))
+
+
+def _chain(stamp):
+    """Manifests from the full snapshot up to stamp, oldest first"""
+    chain = []
+    while stamp is not None:
+        manifest = _load_manifest(stamp)
+        chain.append(manifest)
+        stamp = manifest["parent"]
+    return list(reversed(chain))
+
+
+def _report(kind, stamp, copy_stats, stored_pages):
+    print(f"💾 [BACKUP] {kind} snapshot {stamp}: {stored_pages} of {copy_stats['pages']} pages stored")
+    print(f"⏱️ [BACKUP] {copy_stats['pages_per_second']:.0f} pages/s | "
+          f"lock held {copy_stats['lock_seconds'] * 1000:.1f}ms total, {copy_stats['max_lock_ms']:.1f}ms max step | "
+          f"{copy_stats['restarts']} restarts{' | single-step fallback' if copy_stats['fallback'] else ''}")
+
+
+def take_snapshot(incremental=False):
+    """
+    Take a full snapshot, or an incremental one on top of the latest snapshot
+
+    Falls back to a full snapshot when there is nothing to build on.
+    Returns the new snapshot's manifest.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    snapshots = list_snapshots()
+    parent = _load_manifest(snapshots[-1]) if incremental and snapshots else None
+
+    fd, copy_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        copy_stats = online_copy(copy_path)
+        page_size = _page_size(copy_path)
+        if parent and parent["page_size"] != page_size:
+            parent = None  # Page size changed (VACUUM); start a new chain
+
+        hashes = []
+        if parent is None:
+            with open(copy_path, "rb") as src, gzip.open(os.path.join(BACKUP_DIR, f"{stamp}.full.db.gz"), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            hashes = [_page_hash(page) for page in _iter_pages(copy_path, page_size)]
+            stored_pages = len(hashes)
+        else:
+            stored_pages = 0
+            with gzip.open(os.path.join(BACKUP_DIR, f"{stamp}.pages.gz"), "wb") as dst:
+                for number, page in enumerate(_iter_pages(copy_path, page_size)):
+                    digest = _page_hash(page)
+                    hashes.append(digest)
+                    if number >= len(parent["hashes"]) or parent["hashes"][number] != digest:
+                        dst.write(_PAGE_RECORD.pack(number))
+                        dst.write(page)
+                        stored_pages += 1
+    finally:
+        os.remove(copy_path)
+
+    manifest = {
+        "stamp": stamp,
+        "type": "full" if parent is None else "incremental",
+        "parent": parent["stamp"] if parent else None,
+        "page_size": page_size,
+        "page_count": len(hashes),
+        "hashes": hashes,
+        "stats": copy_stats,
+    }
+    # The manifest goes last: a snapshot without one doesn't exist
+    with open(_manifest_path(stamp), "w") as f:
+        json.dump(manifest, f)
+    _report(manifest["type"], stamp, copy_stats, stored_pages)
+    return manifest
+
+
+# ----------------------
+# Restore / verify
+# ----------------------
+def restore(target_path, stamp=None):
+    """Rebuild the database as of snapshot stamp (default latest) at target_path, then verify it"""
+    snapshots = list_snapshots()
+    if not snapshots:
+        raise BackupError(f"No snapshots in {BACKUP_DIR}")
+    stamp = stamp or snapshots[-1]
+    if stamp not in snapshots:
+        raise BackupError(f"Unknown snapshot: {stamp}")
+    chain = _chain(stamp)
+    target = chain[-1]
+
+    with gzip.open(os.path.join(BACKUP_DIR, f"{chain[0]['stamp']}.full.db.gz"), "rb") as src, open(target_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    page_size = target["page_size"]
+    with open(target_path, "r+b") as db_file:
+        for manifest in chain[1:]:
+            with gzip.open(os.path.join(BACKUP_DIR, f"{manifest['stamp']}.pages.gz"), "rb") as pages:
+                while True:
+                    header = pages.read(_PAGE_RECORD.size)
+                    if not header:
+                        break
+                    (number,) = _PAGE_RECORD.unpack(header)
+                    db_file.seek(number * page_size)
+                    db_file.write(pages.read(page_size))
+        db_file.truncate(target["page_count"] * page_size)
+
+    verify_file(target_path, target)
+    print(f"✅ [BACKUP] Restored snapshot {stamp} to {target_path}")
+    return target_path
+
+
+def verify_file(path, manifest):
+    """Check a restored file page-by-page against its manifest and run SQLite's integrity check"""
+    hashes = [_page_hash(page) for page in _iter_pages(path, manifest["page_size"])]
+    if hashes != manifest["hashes"]:
+        raise BackupError(f"Restored pages do not match snapshot {manifest['stamp']}")
+
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"Integrity check failed for snapshot {manifest['stamp']}: {result}")
+
+
+def verify(stamp=None):
+    """Restore a snapshot (default latest) to a scratch file to prove it is usable"""
+    fd, scratch = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        restore(scratch, stamp)
+        print(f"✅ [BACKUP] Snapshot {stamp or list_snapshots()[-1]} verified")
+    finally:
+        for path in (scratch, scratch + "-wal", scratch + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backup of the AANF banking ledger")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("full", help="Take a full snapshot")
+    commands.add_parser("incremental", help="Store only the pages changed since the latest snapshot")
+    verify_parser = commands.add_parser("verify", help="Restore a snapshot to a scratch file and check it")
+    verify_parser.add_argument("stamp", nargs="?")
+    restore_parser = commands.add_parser("restore", help="Restore a snapshot to a new database file")
+    restore_parser.add_argument("target")
+    restore_parser.add_argument("stamp", nargs="?")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "full":
+            take_snapshot()
+        elif args.command == "incremental":
+            take_snapshot(incremental=True)
+        elif args.command == "verify":
+            verify(args.stamp)
+        else:
+            if os.path.abspath(args.target) == os.path.abspath(DATABASE_PATH):
+                raise BackupError("Refusing to restore over the live database; restore elsewhere and swap it in while stopped")
+            restore(args.target, args.stamp)
+    except BackupError as e:
+        print(f"❌ [BACKUP] {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
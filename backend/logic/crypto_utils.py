@@ -1,10 +1,19 @@
 import os
+import re
 import hashlib
 import hmac
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 
+def is_hex(value):
+    """Check that value is a hex string that can be stored as bytes (keys, AKIDs, signatures)"""
+    return isinstance(value, str) and re.fullmatch(r"(?:[0-9a-fA-F]{2})+", value) is not None
+
+def canonical_hex(value):
+    """Lower-case form of a hex string, as the database hands it back, or None if value isn't hex"""
+    return value.lower() if is_hex(value) else None
+
 def generate_ki():
     """Generate a random Ki (subscriber authentication key)"""
     ki = os.urandom(32).hex()
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import secrets
+import threading
+import time
+
+from models.database import SessionLocal, Transaction
+
+# Server-sent transaction events.
+#
+# record_transaction publishes every ledger insert here, and the broker fans it
+# out to that user's open streams. Each stream has a bounded queue: a consumer
+# that falls behind is sent a `resync` event and disconnected instead of slowing
+# payments down, and reconnects with Last-Event-ID to pick up where it left off.
+
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "100"))
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get("EVENT_KEEPALIVE_SECONDS", "15"))
+STREAM_TICKET_SECONDS = int(os.environ.get("STREAM_TICKET_SECONDS", "60"))
+
+# Pushed into a subscriber's queue when it has overflowed
+_OVERFLOW = object()
+
+
+def transaction_event(t):
+    return {
+        "id": t.id,
+        "amount": t.amount,
+        "method": t.method,
+        "timestamp": t.timestamp.isoformat()
+    }
+
+
+class Subscription:
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+
+class TransactionBroker:
+    """In-process pub/sub of ledger inserts, keyed by user"""
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}  # user_id -> set of Subscription
+        self.loop = None
+
+    def subscribe(self, user_id):
+        # Subscriptions are only ever touched on the event loop thread
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription(user_id, self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self.subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.user_id]
+
+    def publish(self, transaction):
+        """Queue a committed Transaction for its user's streams. Safe to call from any thread."""
+        if self.loop is None or self.loop.is_closed():
+            return  # Nobody has ever subscribed
+        self.loop.call_soon_threadsafe(self._fan_out, transaction.user_id, transaction_event(transaction))
+
+    def _fan_out(self, user_id, event):
+        for subscription in list(self.subscribers.get(user_id, ())):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow: drop what it hasn't read and tell it to reconnect
+                print(f"⚠️ [EVENTS] Subscriber for user {user_id} fell behind, forcing resync")
+                self.unsubscribe(subscription)
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(_OVERFLOW)
+
+
+broker = TransactionBroker()
+
+
+# ----------------------
+# Stream tickets
+# ----------------------
+# EventSource clients can't send an Authorization header. Instead of putting the
+# login JWT in the URL (and so in access logs), they swap it for a short-lived,
+# single-use ticket that only opens an event stream.
+_stream_tickets = {}  # ticket -> (user_id, expires_at)
+_stream_tickets_lock = threading.Lock()
+
+
+def issue_stream_ticket(user_id):
+    ticket = secrets.token_urlsafe(24)
+    now = time.time()
+    with _stream_tickets_lock:
+        # Drop expired tickets so unredeemed ones don't pile up
+        for stale in [t for t, (_, expires_at) in _stream_tickets.items() if expires_at <= now]:
+            del _stream_tickets[stale]
+        _stream_tickets[ticket] = (user_id, now + STREAM_TICKET_SECONDS)
+    return ticket
+
+
+def redeem_stream_ticket(ticket):
+    """Return the ticket's user_id, or None if it is unknown, used or expired"""
+    with _stream_tickets_lock:
+        entry = _stream_tickets.pop(ticket, None)
+    if entry is None or entry[1] <= time.time():
+        return None
+    return entry[0]
+
+
+def _format(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _missed_transactions(user_id, last_id):
+    """Hot-table entries after last_id; archived months are not replayed"""
+    db = SessionLocal()
+    try:
+        return [
+            transaction_event(t)
+            for t in db.query(Transaction)
+            .filter(Transaction.user_id == user_id, Transaction.id > last_id)
+            .order_by(Transaction.id)
+        ]
+    finally:
+        db.close()
+
+
+async def stream_transactions(request, user_id, last_id=None):
+    """
+    Yield a user's new transactions as server-sent events
+
+    With last_id, anything the client missed is replayed from the ledger first.
+    """
+    subscription = broker.subscribe(user_id)
+    try:
+        sent_id = last_id or 0
+        replayed = set()
+        if last_id is not None:
+            # Subscribed first, so nothing committed during the replay is lost
+            for event in await asyncio.to_thread(_missed_transactions, user_id, last_id):
+                replayed.add(event["id"])
+                sent_id = max(sent_id, event["id"])
+                yield _format("transaction", event, event["id"])
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
+
+            if event is _OVERFLOW:
+                yield _format("resync", {"last_id": sent_id})
+                return
+            # Concurrent payments can publish out of id order, so only skip
+            # the exact events the replay already sent
+            if event["id"] in replayed:
+                continue
+            sent_id = max(sent_id, event["id"])
+            yield _format("transaction", event, event["id"])
+    finally:
+        broker.unsubscribe(subscription)
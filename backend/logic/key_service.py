@@ -0,0 +1,234 @@
+import asyncio
+import os
+import time
+
+from models.database import SessionLocal, SimKey
+from logic.crypto_utils import derive_kaf, canonical_hex
+
+# Client for the operator's AANF key service.
+#
+# create_session asks the AANF for the KAF of an (AKID, AFID) pair. Backends:
+#   local - in-process stand-in that derives the KAF from our own sim_keys table
+#   http  - the AANF over pooled HTTP connections (HTTP/2 when the server offers it)
+# Every backend is wrapped with a per-request deadline, a circuit breaker and a
+# single-flight layer so concurrent requests for the same pair share one call.
+
+AANF_KEY_SERVICE = os.environ.get("AANF_KEY_SERVICE", "local")
+AANF_URL = os.environ.get("AANF_URL", "http://localhost:8000")
+AANF_DEADLINE_SECONDS = float(os.environ.get("AANF_DEADLINE_MS", "2000")) / 1000
+AANF_POOL_SIZE = int(os.environ.get("AANF_POOL_SIZE", "20"))
+AANF_H2C = os.environ.get("AANF_H2C", "false").lower() == "true"
+AANF_BREAKER_FAILURES = int(os.environ.get("AANF_BREAKER_FAILURES", "5"))
+AANF_BREAKER_RESET_SECONDS = float(os.environ.get("AANF_BREAKER_RESET_SECONDS", "30"))
+
+KAF_LIFETIME_SECONDS = 3600
+
+
+class KeyServiceError(Exception):
+    """The AANF answered, but refused the request (e.g. unknown AKID)"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class KeyServiceUnavailable(KeyServiceError):
+    """The AANF could not be reached in time, or the breaker is open"""
+
+    def __init__(self, detail="AANF key service unavailable"):
+        super().__init__(503, detail)
+
+
+# ----------------------
+# Backends
+# ----------------------
+class LocalKeyService:
+    """In-process stand-in for the AANF, backed by the sim_keys table"""
+
+    async def fetch_kaf(self, akid, afid):
+        return await asyncio.to_thread(self._fetch_kaf, akid, afid)
+
+    def _fetch_kaf(self, akid, afid):
+        akid = canonical_hex(akid)
+        db = SessionLocal()
+        try:
+            sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first() if akid else None
+            if not sim_key:
+                raise KeyServiceError(403, "Invalid or expired AKMA key")
+            kaf = derive_kaf(sim_key.kakma, afid)
+        finally:
+            db.close()
+        return {"kaf": kaf, "expiry_time": int(time.time()) + KAF_LIFETIME_SECONDS}
+
+    async def close(self):
+        pass
+
+
+class HttpKeyService:
+    """
+    Remote AANF reached over pooled HTTP connections
+
+    HTTP/2 is negotiated over TLS (https:// URLs). httpx can't upgrade plain
+    http:// to HTTP/2, so those stay on HTTP/1.1 unless h2c=True, which speaks
+    HTTP/2 directly and needs an h2c-capable server.
+
+    This app's own /aanf/aanf-internal/get-akma-key endpoint speaks the same
+    protocol, so pointing AANF_URL at a running instance gives a local stand-in
+    (HTTP/1.1 only: uvicorn doesn't serve HTTP/2).
+    """
+
+    def __init__(self, base_url, pool_size, h2c=False):
+        import httpx
+
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            http1=not h2c,
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def fetch_kaf(self, akid, afid):
+        try:
+            response = await self.client.post(
+                "/aanf/aanf-internal/get-akma-key",
+                params={"akid": akid, "afid": afid},
+            )
+        except self._httpx.HTTPError as e:
+            raise KeyServiceUnavailable(f"AANF request failed: {e}")
+
+        if response.status_code >= 500:
+            raise KeyServiceUnavailable(f"AANF returned {response.status_code}")
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", "AANF rejected the request")
+            except ValueError:
+                detail = "AANF rejected the request"
+            raise KeyServiceError(response.status_code, detail)
+        return response.json()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# ----------------------
+# Resilience layers
+# ----------------------
+class CircuitBreaker:
+    """
+    Fail fast after `failure_threshold` consecutive outages
+
+    While open every call is rejected; after `reset_timeout` seconds a single
+    trial call is let through and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            raise KeyServiceUnavailable("AANF circuit breaker is open")
+        if state == "half_open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            print(f"⚡ [AANF-CLIENT] Circuit breaker OPEN after {self.failures} failures")
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one shared upstream call"""
+
+    def __init__(self):
+        self.in_flight = {}
+
+    async def do(self, key, fn):
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shield so one caller going away doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+
+class KeyServiceClient:
+    """Deadline + circuit breaker + single-flight around a key service backend"""
+
+    def __init__(self, backend, deadline, breaker):
+        self.backend = backend
+        self.deadline = deadline
+        self.breaker = breaker
+        self.single_flight = SingleFlight()
+
+    async def get_kaf(self, akid, afid):
+        """Return {"kaf", "expiry_time"} for (akid, afid)"""
+        return await self.single_flight.do((akid, afid), lambda: self._call(akid, afid))
+
+    async def _call(self, akid, afid):
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.backend.fetch_kaf(akid, afid), self.deadline)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise KeyServiceUnavailable(f"AANF did not answer within {self.deadline * 1000:.0f}ms")
+        except KeyServiceUnavailable:
+            self.breaker.record_failure()
+            raise
+        except KeyServiceError:
+            # The AANF is healthy, it just said no
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            # Anything unexpected (bad payload, DB error) counts as an outage
+            self.breaker.record_failure()
+            raise KeyServiceUnavailable(f"AANF request failed: {e!r}")
+        finally:
+            # Never leave a half-open trial stuck, even if the call was cancelled
+            self.breaker.trial_in_flight = False
+        self.breaker.record_success()
+        print(f"🔐 [AANF-CLIENT] KAF for AKID {akid[:8]}... fetched in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return result
+
+    async def close(self):
+        await self.backend.close()
+
+
+def build_key_service():
+    if AANF_KEY_SERVICE == "http":
+        backend = HttpKeyService(AANF_URL, AANF_POOL_SIZE, h2c=AANF_H2C)
+    elif AANF_KEY_SERVICE == "local":
+        backend = LocalKeyService()
+    else:
+        raise ValueError(f"Unknown AANF_KEY_SERVICE: {AANF_KEY_SERVICE}")
+    return KeyServiceClient(
+        backend,
+        deadline=AANF_DEADLINE_SECONDS,
+        breaker=CircuitBreaker(AANF_BREAKER_FAILURES, AANF_BREAKER_RESET_SECONDS),
+    )
+
+
+key_service = build_key_service()
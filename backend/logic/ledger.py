@@ -0,0 +1,269 @@
+import asyncio
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models.database import BASE_DIR, SessionLocal, Transaction
+from models.migrations import add_missing_columns
+from logic.events import broker
+
+# Month-partitioned ledger.
+#
+# The `transactions` table only holds open (hot) months. Closed months are moved
+# by the archiver into gzip-compressed, read-only SQLite files, one per month:
+#   archive/transactions_YYYY_MM.db.gz
+# History queries read the hot table plus only the archives overlapping the
+# requested date range. Archives are decompressed once into ARCHIVE_CACHE_DIR and
+# read from there until the archiver rewrites them.
+
+ARCHIVE_DIR = os.environ.get("LEDGER_ARCHIVE_DIR", os.path.join(BASE_DIR, "../archive"))
+ARCHIVE_CACHE_DIR = os.environ.get("LEDGER_ARCHIVE_CACHE_DIR", os.path.join(ARCHIVE_DIR, "cache"))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get("LEDGER_ARCHIVE_INTERVAL", "3600"))
+# Keeps each DELETE ... WHERE id IN (...) under SQLite's bound-parameter limit
+DELETE_BATCH_SIZE = 500
+
+transactions_table = Transaction.__table__
+
+
+def month_start(dt):
+    """Return midnight on the first day of dt's month"""
+    return datetime.datetime(dt.year, dt.month, 1)
+
+
+def next_month_start(dt):
+    """Return midnight on the first day of the month after dt"""
+    if dt.month == 12:
+        return datetime.datetime(dt.year + 1, 1, 1)
+    return datetime.datetime(dt.year, dt.month + 1, 1)
+
+
+def partition_key(dt):
+    """Partition name for the month containing dt, e.g. '2025_04'"""
+    return f"{dt.year:04d}_{dt.month:02d}"
+
+
+def partition_start(key):
+    """Inverse of partition_key: midnight on the first day of the partition's month"""
+    year, month = key.split("_")
+    return datetime.datetime(int(year), int(month), 1)
+
+
+def _as_utc(dt):
+    """Ledger timestamps are naive UTC; normalise aware datetimes to match"""
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def archive_path(key):
+    return os.path.join(ARCHIVE_DIR, f"transactions_{key}.db.gz")
+
+
+def list_archives():
+    """Return {partition_key: path} for every archived month"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return {}
+    archives = {}
+    for name in os.listdir(ARCHIVE_DIR):
+        if name.startswith("transactions_") and name.endswith(".db.gz"):
+            key = name[len("transactions_"):-len(".db.gz")]
+            archives[key] = os.path.join(ARCHIVE_DIR, name)
+    return dict(sorted(archives.items()))
+
+
+@contextmanager
+def _open_archive(path):
+    """Decompress an archive (if present) into a scratch SQLite file and yield an engine on it"""
+    fd, scratch = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        if os.path.exists(path):
+            with gzip.open(path, "rb") as src, open(scratch, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        engine = create_engine(f"sqlite:///{scratch}")
+        try:
+            transactions_table.create(engine, checkfirst=True)
+            with engine.begin() as conn:
+                add_missing_columns(conn, transactions_table.name)  # Archives written before a column existed
+            yield engine, scratch
+        finally:
+            engine.dispose()
+    finally:
+        os.remove(scratch)
+
+
+def _write_archive(path, rows):
+    """Merge rows into the archive at path. Re-running with the same rows is a no-op."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with _open_archive(path) as (engine, scratch):
+        with engine.begin() as conn:
+            conn.execute(sqlite_insert(transactions_table).on_conflict_do_nothing(), rows)
+        engine.dispose()
+
+        tmp_path = path + ".tmp"
+        with open(scratch, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        if os.path.exists(path):
+            os.chmod(path, 0o644)
+        os.replace(tmp_path, path)
+        os.chmod(path, 0o444)
+
+
+# Decompressed archives, kept until the .gz file changes: {path: (stamp, engine)}
+_archive_engines = {}
+_archive_engines_lock = threading.Lock()
+
+
+def _archive_engine(path):
+    """Read-only engine on a cached, decompressed copy of the archive at path"""
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _archive_engines_lock:
+        cached = _archive_engines.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        os.makedirs(ARCHIVE_CACHE_DIR, exist_ok=True)
+        cache_path = os.path.join(ARCHIVE_CACHE_DIR, os.path.basename(path)[:-len(".gz")])
+        tmp_path = cache_path + ".tmp"
+        with gzip.open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        upgrade_engine = create_engine(f"sqlite:///{tmp_path}")
+        try:
+            with upgrade_engine.begin() as conn:
+                add_missing_columns(conn, transactions_table.name)
+        finally:
+            upgrade_engine.dispose()
+        # Readers still on the old copy keep their open file until they finish
+        os.replace(tmp_path, cache_path)
+
+        engine = create_engine(f"sqlite:///file:{cache_path}?mode=ro&uri=true")
+        if cached is not None:
+            cached[1].dispose()
+        _archive_engines[path] = (stamp, engine)
+        return engine
+
+
+def _read_archive(path, user_id, start, end, limit=None):
+    with _archive_engine(path).connect() as conn:
+        return conn.execute(_history_query(user_id, start, end, limit)).all()
+
+
+def _history_query(user_id, start, end, limit=None):
+    query = select(transactions_table)
+    if user_id is not None:
+        query = query.where(transactions_table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(transactions_table.c.timestamp >= start)
+    if end is not None:
+        query = query.where(transactions_table.c.timestamp < end)
+    if limit is not None:
+        # Newest first, so only the rows that can make the cut are read
+        query = query.order_by(transactions_table.c.timestamp.desc(), transactions_table.c.id.desc()).limit(limit)
+    return query
+
+
+# ----------------------
+# Insert routing
+# ----------------------
+def record_transaction(db, user_id, amount, method, hash_verification=None, device_id=None):
+    """Insert a ledger entry into the partition for the current month and return it"""
+    transaction = Transaction(
+        user_id=user_id,
+        amount=amount,
+        method=method,
+        hash_verification=hash_verification,
+        device_id=device_id,
+        timestamp=datetime.datetime.utcnow()
+    )
+    # The current month is always open, so it lives in the hot table
+    db.add(transaction)
+    db.commit()
+    db.refresh(transaction)
+    # Push to any open transaction event streams for this user
+    broker.publish(transaction)
+    return transaction
+
+
+# ----------------------
+# History queries
+# ----------------------
+def query_history(db, user_id, start=None, end=None, limit=None):
+    """
+    Return a user's ledger entries in [start, end), oldest first
+
+    Pass user_id=None for every user's entries. Only archived months that overlap
+    [start, end) are read. With a limit only the newest `limit` entries are
+    returned, and archives are read newest first until older months can no
+    longer make the cut.
+    """
+    start, end = _as_utc(start), _as_utc(end)
+    first_key = partition_key(start) if start else None
+    last_key = partition_key(end - datetime.timedelta(microseconds=1)) if end else None
+
+    rows = list(db.execute(_history_query(user_id, start, end, limit)).all())
+    for key, path in reversed(list_archives().items()):
+        if (first_key and key < first_key) or (last_key and key > last_key):
+            continue
+        if limit is not None and len(rows) >= limit:
+            rows.sort(key=lambda r: (r.timestamp, r.id), reverse=True)
+            del rows[limit:]
+            if next_month_start(partition_start(key)) <= rows[-1].timestamp:
+                break  # This month and every older one are all older than the cut
+        rows.extend(_read_archive(path, user_id, start, end, limit))
+
+    rows.sort(key=lambda r: (r.timestamp, r.id))
+    if limit is not None:
+        rows = rows[-limit:]
+    return rows
+
+
+# ----------------------
+# Archiver
+# ----------------------
+def archive_closed_months(now=None):
+    """Move every closed month out of the hot table. Returns the number of rows archived."""
+    cutoff = month_start(now or datetime.datetime.utcnow())
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(transactions_table).where(transactions_table.c.timestamp < cutoff)
+        ).mappings().all()
+        if not rows:
+            return 0
+
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(partition_key(row["timestamp"]), []).append(dict(row))
+
+        for key, month_rows in sorted(by_month.items()):
+            _write_archive(archive_path(key), month_rows)
+            # Only delete once the archive is safely on disk, and only the rows
+            # that went into it: anything committed since the select stays hot
+            ids = [r["id"] for r in month_rows]
+            for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                db.execute(transactions_table.delete().where(
+                    transactions_table.c.id.in_(ids[i:i + DELETE_BATCH_SIZE])
+                ))
+            db.commit()
+            print(f"🗄️ [LEDGER] Archived {len(month_rows)} transactions for {key}")
+        return len(rows)
+    finally:
+        db.close()
+
+
+async def run_archiver(interval=ARCHIVE_INTERVAL_SECONDS):
+    """Background task: archive closed months now and then every `interval` seconds"""
+    while True:
+        try:
+            await asyncio.to_thread(archive_closed_months)
+        except Exception as e:
+            print(f"❌ [LEDGER] Archiver error: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,209 @@
+import datetime
+import json
+import math
+import os
+import threading
+import time
+
+from logic.ledger import query_history
+
+# In-memory velocity checks.
+#
+# Every user and device keeps a count and an amount sum over sliding 1-minute,
+# 1-hour and 1-day windows. Each window is a ring of fixed-width buckets with
+# running totals, so recording a payment and reading a window are both O(1)
+# (amortised) and payments never need to query the transactions table.
+# Windows that have emptied out are dropped every PRUNE_INTERVAL_SECONDS.
+
+# window name -> (bucket width in seconds, number of buckets)
+WINDOWS = {
+    "1m": (1, 60),
+    "1h": (60, 60),
+    "1d": (900, 96),
+}
+
+DEFAULT_RULES = [
+    {"scope": "user", "window": "1m", "max_count": 5},
+    {"scope": "user", "window": "1h", "max_count": 30},
+    {"scope": "user", "window": "1h", "max_amount": 100000},
+    {"scope": "user", "window": "1d", "max_amount": 200000},
+    {"scope": "device", "window": "1m", "max_count": 5},
+    {"scope": "device", "window": "1d", "max_amount": 200000},
+]
+
+PRUNE_INTERVAL_SECONDS = 60
+
+
+def load_rules():
+    """Rules come from VELOCITY_RULES (a JSON list) or fall back to DEFAULT_RULES"""
+    raw = os.environ.get("VELOCITY_RULES")
+    rules = json.loads(raw) if raw else DEFAULT_RULES
+    for rule in rules:
+        if rule.get("scope") not in ("user", "device"):
+            raise ValueError(f"Velocity rule has unknown scope: {rule}")
+        if rule.get("window") not in WINDOWS:
+            raise ValueError(f"Velocity rule has unknown window: {rule}")
+        if "max_count" not in rule and "max_amount" not in rule:
+            raise ValueError(f"Velocity rule needs max_count or max_amount: {rule}")
+    return rules
+
+
+class VelocityViolation(Exception):
+    """A payment would break a velocity rule"""
+
+
+class SlidingWindow:
+    """Count and amount sum over the last `num_buckets * bucket_seconds` seconds"""
+
+    __slots__ = ("bucket_seconds", "num_buckets", "counts", "sums", "head", "count", "total")
+
+    def __init__(self, bucket_seconds, num_buckets):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = num_buckets
+        self.counts = [0] * num_buckets
+        self.sums = [0.0] * num_buckets
+        self.head = None  # index of the newest bucket
+        self.count = 0
+        self.total = 0.0
+
+    def _advance(self, bucket):
+        """Expire every bucket that has slid out of the window by `bucket`"""
+        if self.head is None:
+            self.head = bucket
+            return
+        if bucket <= self.head:
+            return
+        for i in range(1, min(bucket - self.head, self.num_buckets) + 1):
+            slot = (self.head + i) % self.num_buckets
+            self.count -= self.counts[slot]
+            self.total -= self.sums[slot]
+            self.counts[slot] = 0
+            self.sums[slot] = 0.0
+        self.head = bucket
+
+    def add(self, now, amount):
+        if not math.isfinite(amount):
+            raise ValueError(f"Velocity windows only take finite amounts, got {amount}")
+        bucket = int(now // self.bucket_seconds)
+        self._advance(bucket)
+        if bucket <= self.head - self.num_buckets:
+            return  # Older than the window (only happens while seeding)
+        slot = bucket % self.num_buckets
+        self.counts[slot] += 1
+        self.sums[slot] += amount
+        self.count += 1
+        self.total += amount
+
+    def remove(self, now, amount):
+        """Take back an add() made at `now`, if that bucket is still in the window"""
+        bucket = int(now // self.bucket_seconds)
+        self._advance(bucket)
+        if bucket <= self.head - self.num_buckets:
+            return  # Already expired
+        slot = bucket % self.num_buckets
+        self.counts[slot] -= 1
+        self.sums[slot] -= amount
+        self.count -= 1
+        self.total -= amount
+
+    def totals(self, now):
+        self._advance(int(now // self.bucket_seconds))
+        return self.count, self.total
+
+
+class VelocityEngine:
+    def __init__(self, rules):
+        self.rules = rules
+        self.windows = {}  # (scope, id) -> {window name: SlidingWindow}
+        self.lock = threading.Lock()
+        self.last_pruned = time.time()
+
+    def _windows_for(self, key):
+        windows = self.windows.get(key)
+        if windows is None:
+            windows = {name: SlidingWindow(*shape) for name, shape in WINDOWS.items()}
+            self.windows[key] = windows
+        return windows
+
+    def _record(self, keys, amount, now):
+        for key in keys:
+            for window in self._windows_for(key).values():
+                window.add(now, amount)
+
+    def _prune(self, now):
+        """Forget users and devices with nothing left in any window"""
+        self.last_pruned = now
+        for key in [k for k, windows in self.windows.items() if not any(w.totals(now)[0] for w in windows.values())]:
+            del self.windows[key]
+
+    def admit(self, user_id, device_id, amount, now=None):
+        """
+        Check a payment against every rule and, if it passes, count it
+
+        Raises VelocityViolation without recording anything if a rule would be broken,
+        and ValueError for an amount that isn't a positive, finite number.
+        Check and record happen under one lock so concurrent payments can't both
+        slip under a limit. Returns the time the payment was counted at; pass it
+        to release() if the payment is not saved after all.
+        """
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValueError(f"Payment amount must be positive and finite, got {amount}")
+        now = time.time() if now is None else now
+        keys = {"user": ("user", user_id)}
+        if device_id:
+            keys["device"] = ("device", device_id)
+
+        with self.lock:
+            if now - self.last_pruned >= PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+            for rule in self.rules:
+                key = keys.get(rule["scope"])
+                if key is None:
+                    continue
+                count, total = self._windows_for(key)[rule["window"]].totals(now)
+                if "max_count" in rule and count + 1 > rule["max_count"]:
+                    raise VelocityViolation(
+                        f"More than {rule['max_count']} payments per {rule['window']} for this {rule['scope']}"
+                    )
+                if "max_amount" in rule and total + amount > rule["max_amount"]:
+                    raise VelocityViolation(
+                        f"Payments over ₹{rule['max_amount']} per {rule['window']} for this {rule['scope']}"
+                    )
+            self._record(keys.values(), amount, now)
+        return now
+
+    def release(self, user_id, device_id, amount, admitted_at):
+        """Undo admit() for a payment that was never committed"""
+        keys = [("user", user_id)]
+        if device_id:
+            keys.append(("device", device_id))
+        with self.lock:
+            for key in keys:
+                windows = self.windows.get(key)
+                if windows is None:
+                    continue  # Pruned, so nothing of this payment is left in the window
+                for window in windows.values():
+                    window.remove(admitted_at, amount)
+
+    def seed(self, transactions):
+        """Replay recent ledger entries (oldest first) so limits survive a restart"""
+        with self.lock:
+            for t in transactions:
+                if t.amount is None or not math.isfinite(t.amount) or t.amount <= 0:
+                    continue  # Saved before amounts were validated
+                keys = [("user", t.user_id)]
+                if t.device_id:
+                    keys.append(("device", t.device_id))
+                now = t.timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+                self._record(keys, t.amount, now)
+
+
+velocity = VelocityEngine(load_rules())
+
+
+def seed_from_ledger(db):
+    """Load the last day of transactions into the velocity windows. Returns the row count."""
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    transactions = query_history(db, None, start=since)
+    velocity.seed(transactions)
+    return len(transactions)
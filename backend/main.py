@@ -1,8 +1,15 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from routes import traditional, aanf
 from models.database import get_db, SessionLocal
+from models.migrations import migrate_hex_to_binary, migrate_added_columns
 from sqlalchemy import text  # Add this import
+from logic.ledger import run_archiver
+from logic.key_service import key_service
+from logic.velocity import seed_from_ledger
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -38,11 +45,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Validation errors without the rejected input: a NaN amount can't be rendered as JSON
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    errors = [{key: error[key] for key in ("type", "loc", "msg")} for error in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": errors})
+
 # Add database dependency to startup
 @app.on_event("startup")
 async def startup():
     print("\n" + "="*80)
     print("📦 Initializing database connection...")
+    # Bring older databases up to binary key storage. Outside the try below on
+    # purpose: if the migration fails the app must not start on a broken schema.
+    migrate_hex_to_binary()
+    migrate_added_columns()
+
     # Initialize database connection
     db = SessionLocal()
     try:
@@ -59,13 +77,29 @@ async def startup():
         from models.database import Transaction
         tx_count = db.query(Transaction).count()
         print(f"💰 Found {tx_count} existing transactions in database")
+
+        # Warm the velocity windows with the last day of payments
+        seeded = seed_from_ledger(db)
+        print(f"🛡️ Seeded velocity checks with {seeded} recent transactions")
         
     except Exception as e:
         print(f"❌ Database error: {e}")
     finally:
         db.close()
+
+    # Move closed months out of the hot transactions table in the background
+    # Keep a reference: the event loop only holds tasks weakly
+    app.state.archiver = asyncio.create_task(run_archiver())
+    print("🗄️ Ledger archiver started")
     print("="*80 + "\n")
 
+@app.on_event("shutdown")
+async def shutdown():
+    archiver = getattr(app.state, "archiver", None)
+    if archiver is not None:
+        archiver.cancel()
+    await key_service.close()
+
 @app.get("/")
 def read_root():
     return {"status": "online", "message": "AANF Banking API is running"}
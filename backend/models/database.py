@@ -1,17 +1,42 @@
 # database.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import datetime
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, '../aanf_banking.db')}"
+DATABASE_PATH = os.path.join(BASE_DIR, '../aanf_banking.db')
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
 engine = create_engine(DATABASE_URL)
+
+@event.listens_for(engine, "connect")
+def _enable_wal(dbapi_connection, connection_record):
+    # WAL lets readers, including online backups, run alongside payment writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+class HexBinary(TypeDecorator):
+    """Hex string in Python, raw bytes (BLOB) in the database - half the size on disk"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value  # Rows written before the binary migration
+        return value.hex()
+
 class User(Base):
     __tablename__ = "users"
     
@@ -27,9 +52,9 @@ class SimKey(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    ki = Column(String, unique=True)
-    kakma = Column(String)
-    akid = Column(String, unique=True)
+    ki = Column(HexBinary(32), unique=True)
+    kakma = Column(HexBinary(32))
+    akid = Column(HexBinary(8), unique=True)
     device_id = Column(String)
     carrier = Column(String)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -39,13 +64,16 @@ class SimKey(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    # Never reuse ids: rows move out to monthly archives (see logic/ledger.py)
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     amount = Column(Float)
     method = Column(String)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-    hash_verification = Column(String, nullable=True)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    hash_verification = Column(HexBinary(32), nullable=True)
+    device_id = Column(String, nullable=True)  # AANF payments only; seeds device velocity windows
     
     user = relationship("User", back_populates="transactions")
 
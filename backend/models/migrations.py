@@ -0,0 +1,171 @@
+# migrations.py
+from sqlalchemy import MetaData, Table, create_engine, event, select
+
+from models.database import Base, engine
+from logic.crypto_utils import is_hex
+
+# Columns that used to be hex TEXT and are now stored as raw bytes (HexBinary)
+HEX_COLUMNS = {
+    "sim_keys": ["ki", "kakma", "akid"],
+    "transactions": ["hash_verification"],
+}
+
+# Nullable columns added to a model after its table was first created
+ADDED_COLUMNS = {
+    "transactions": ["device_id"],
+}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _transactional_engine(url):
+    """
+    Engine whose transactions really cover DDL
+
+    pysqlite commits on its own before CREATE/ALTER/DROP, so engine.begin()
+    alone would leave a half-rebuilt table behind on failure. This is
+    SQLAlchemy's documented workaround: turn off pysqlite's transaction
+    handling and emit BEGIN ourselves.
+    """
+    migration_engine = create_engine(url)
+
+    @event.listens_for(migration_engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(migration_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return migration_engine
+
+
+def _table_exists(conn, table_name):
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).first() is not None
+
+
+def _recover_leftover(conn, table_name):
+    """
+    Undo a rebuild that an older, non-atomic run of this migration left half done
+
+    That run could leave every row in <table>_legacy next to an empty new table.
+    Put the legacy table back so the rebuild below runs again from scratch.
+    """
+    legacy_name = f"{table_name}_legacy"
+    if not _table_exists(conn, legacy_name):
+        return
+    count = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table_name}").scalar()
+    if count:
+        raise MigrationError(
+            f"Both {table_name} ({count} rows) and {legacy_name} exist; merge them by hand before starting"
+        )
+    print(f"🔄 [MIGRATION] Recovering {table_name} from leftover {legacy_name}")
+    conn.exec_driver_sql(f"DROP TABLE {table_name}")
+    conn.exec_driver_sql(f"ALTER TABLE {legacy_name} RENAME TO {table_name}")
+
+
+def _column_types(conn, table_name):
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table_name})").all()
+    return {row[1]: row[2].upper() for row in rows}
+
+
+def add_missing_columns(conn, table_name):
+    """Add any of the table's ADDED_COLUMNS it doesn't have yet. Returns the names added."""
+    table = Base.metadata.tables[table_name]
+    types = _column_types(conn, table_name)
+    added = []
+    for name in ADDED_COLUMNS.get(table_name, []):
+        if name not in types:
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}")
+            added.append(name)
+    return added
+
+
+def _rebuild_as_binary(conn, table_name, hex_columns):
+    """
+    Recreate table_name from the current model and copy every row across
+
+    SQLite can't change a column's type in place, so the old table is renamed,
+    a fresh one is created and the hex text is converted to bytes on the way
+    through (HexBinary does the conversion on insert).
+    """
+    legacy_name = f"{table_name}_legacy"
+    conn.exec_driver_sql(f"ALTER TABLE {table_name} RENAME TO {legacy_name}")
+
+    # Named indexes keep their names across a rename and would clash with the new table's
+    index_names = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (legacy_name,)
+    ).scalars().all()
+    for name in index_names:
+        conn.exec_driver_sql(f"DROP INDEX {name}")
+
+    table = Base.metadata.tables[table_name]
+    table.create(conn)
+
+    legacy = Table(legacy_name, MetaData(), autoload_with=conn)
+    rows = [dict(row) for row in conn.execute(select(legacy)).mappings()]
+    for row in rows:
+        for column in hex_columns:
+            value = row.get(column)
+            if value is not None and not is_hex(value):
+                print(f"⚠️ [MIGRATION] Dropping non-hex {table_name}.{column} on row {row.get('id')}")
+                row[column] = None
+    if rows:
+        conn.execute(table.insert(), rows)
+
+    conn.exec_driver_sql(f"DROP TABLE {legacy_name}")
+    return len(rows)
+
+
+def migrate_hex_to_binary(engine=engine):
+    """
+    Convert hex TEXT key/signature columns to BLOB. Safe to run repeatedly.
+
+    Each table is rebuilt in a single transaction: if anything fails (e.g. two
+    keys that only differ by hex case now collide) nothing changes and the
+    error is raised.
+    """
+    migrated = False
+    migration_engine = _transactional_engine(engine.url)
+    try:
+        for table_name, hex_columns in HEX_COLUMNS.items():
+            with migration_engine.begin() as conn:
+                _recover_leftover(conn, table_name)
+                types = _column_types(conn, table_name)
+                if all(types.get(column) == "BLOB" for column in hex_columns):
+                    continue
+                count = _rebuild_as_binary(conn, table_name, hex_columns)
+                print(f"🔄 [MIGRATION] Converted {count} {table_name} rows to binary key storage")
+                migrated = True
+    finally:
+        migration_engine.dispose()
+
+    if migrated:
+        # Give the freed pages back to the filesystem
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+    return migrated
+
+
+def migrate_added_columns(engine=engine):
+    """Add columns introduced since the tables were created. Safe to run repeatedly."""
+    added = False
+    with engine.begin() as conn:
+        for table_name in ADDED_COLUMNS:
+            for name in add_missing_columns(conn, table_name):
+                print(f"🔄 [MIGRATION] Added {table_name}.{name}")
+                added = True
+    return added
+
+
+if __name__ == "__main__":
+    if not migrate_hex_to_binary():
+        print("✅ [MIGRATION] Database already uses binary key storage")
+    if not migrate_added_columns():
+        print("✅ [MIGRATION] Database already has every column")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 class LoginRequest(BaseModel):
@@ -9,7 +9,7 @@ class OTPRequest(BaseModel):
     otp: str
 
 class TransactionRequest(BaseModel):
-    amount: float
+    amount: float = Field(gt=0, allow_inf_nan=False)
 
 class SessionRequest(BaseModel):
     function_id: Optional[str] = "transactions"
@@ -1,16 +1,21 @@
 from fastapi import APIRouter, Request, HTTPException, Header, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 import json
 import time
+import asyncio
 import os  # Add this to the top of the file
 import hmac
 import hashlib
 
 from models.schemas import TransactionRequest, SessionRequest
-from models.database import get_db, SimKey, User, Transaction
-from logic.crypto_utils import derive_kakma, generate_akid, derive_kaf, sign_transaction, verify_transaction, generate_ki
+from models.database import get_db, SessionLocal, SimKey, User, Transaction
+from logic.crypto_utils import derive_kakma, generate_akid, derive_kaf, sign_transaction, verify_transaction, generate_ki, is_hex, canonical_hex
+from logic.ledger import record_transaction
+from logic.key_service import key_service, KeyServiceError
+from logic.velocity import velocity, VelocityViolation
+from logic.events import stream_transactions
 
 router = APIRouter()
 
@@ -141,7 +146,10 @@ async def create_session(request: SessionRequest, x_akma_key: str = Header(None)
     print("="*60)
     
     # Find the SimKey record for this AKID
-    sim_key = db.query(SimKey).filter(SimKey.akid == x_akma_key, SimKey.active == 1).first()
+    # AKIDs are stored as bytes, so anything that isn't hex can't match one. Use the
+    # stored (lower-case) spelling from here on, or keys derived from it won't match.
+    akid = canonical_hex(x_akma_key)
+    sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first() if akid else None
     
     if not sim_key:
         print(f"❌ No active SIM key found for AKID: {x_akma_key}")
@@ -154,8 +162,13 @@ async def create_session(request: SessionRequest, x_akma_key: str = Header(None)
     # Derive KAF for the requested function
     function_id = request.function_id or "transactions"
     
-    # Simulate call to AANF server for key material
-    aanf_response = await get_akma_key(x_akma_key, function_id, db)
+    # Ask the AANF key service for key material
+    try:
+        aanf_response = await key_service.get_kaf(akid, function_id)
+    except KeyServiceError as e:
+        print(f"❌ AANF key request failed: {e.detail}")
+        print("="*60 + "\n")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
     # Before return - Important: Don't return KAF directly to client!
     # Let the client derive it locally for enhanced security
@@ -177,8 +190,9 @@ def aanf_transaction(req: TransactionRequest, x_akma_key: str = Header(None), x_
     print(f"🔏 Has Signature: {'Yes' if x_transaction_sig else 'No'}")
     print("="*60)
     
-    # Find the SimKey record for this AKID
-    sim_key = db.query(SimKey).filter(SimKey.akid == x_akma_key, SimKey.active == 1).first()
+    # Find the SimKey record for this AKID (lower-cased like the stored one)
+    akid = canonical_hex(x_akma_key)
+    sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first() if akid else None
     
     if not sim_key:
         print(f"❌ Invalid or expired AKMA key: {x_akma_key}")
@@ -188,8 +202,8 @@ def aanf_transaction(req: TransactionRequest, x_akma_key: str = Header(None), x_
     print(f"✅ Found valid SIM key for user ID: {sim_key.user_id}")
     
     # For demo purposes, derive KAF using AKID directly (this must match frontend)
-    kaf = derive_kaf(x_akma_key, "transactions")
-    print(f"🔐 Using AKID for KAF derivation: {x_akma_key[:8]}...")
+    kaf = derive_kaf(akid, "transactions")
+    print(f"🔐 Using AKID for KAF derivation: {akid[:8]}...")
     print(f"🔐 Derived KAF: {kaf[:8]}...")
     
     # If a signature is provided, verify transaction integrity
@@ -230,19 +244,34 @@ def aanf_transaction(req: TransactionRequest, x_akma_key: str = Header(None), x_
             else:
                 print("[AANF] ✅ Transaction signature verified successfully!")
     
+    # Velocity checks against recent payments from this user and device
+    check_started = time.perf_counter()
+    try:
+        admitted_at = velocity.admit(sim_key.user_id, sim_key.device_id, req.amount)
+    except VelocityViolation as e:
+        print(f"[AANF] ❌ Transaction REJECTED by velocity check: {e}")
+        print("="*60 + "\n")
+        raise HTTPException(status_code=429, detail=str(e))
+    print(f"🛡️ Velocity check passed in {(time.perf_counter() - check_started) * 1e6:.0f}µs")
+    
     # Process the transaction
     # In a real app, you would integrate with a payment processor
     print(f"[AANF] ✅ Transaction authorized. Amount: ₹{req.amount}")
     
     # Save transaction record
-    transaction = Transaction(
-        user_id=sim_key.user_id,
-        amount=req.amount,
-        method="AANF",
-        hash_verification=x_transaction_sig
-    )
-    db.add(transaction)
-    db.commit()
+    try:
+        transaction = record_transaction(
+            db,
+            user_id=sim_key.user_id,
+            amount=req.amount,
+            method="AANF",
+            hash_verification=x_transaction_sig if is_hex(x_transaction_sig) else None,
+            device_id=sim_key.device_id
+        )
+    except Exception:
+        # Not saved, so it mustn't count towards the velocity limits
+        velocity.release(sim_key.user_id, sim_key.device_id, req.amount, admitted_at)
+        raise
     
     # Sign the response
     response_data = {"message": f"Transaction of ₹{req.amount} successful via AANF", "status": "success"}
@@ -255,6 +284,36 @@ def aanf_transaction(req: TransactionRequest, x_akma_key: str = Header(None), x_
     
     return {**response_data, "signature": response_signature}
 
+# ----------------------------
+# ✅ AANF TRANSACTION EVENT STREAM
+# ----------------------------
+def _stream_user_id(akid):
+    """User ID for an active AKID, on a short-lived session (not held for the stream's lifetime)"""
+    akid = canonical_hex(akid)
+    if akid is None:
+        return None
+    db = SessionLocal()
+    try:
+        sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first()
+        return sim_key.user_id if sim_key else None
+    finally:
+        db.close()
+
+@router.get("/transaction-events")
+async def transaction_events(request: Request, last_id: Optional[int] = None, x_akma_key: str = Header(None), last_event_id: Optional[int] = Header(None)):
+    """Server-sent events for each new transaction; resumes after Last-Event-ID (or last_id)"""
+    # Sync DB work off the event loop
+    user_id = await asyncio.to_thread(_stream_user_id, x_akma_key)
+    if user_id is None:
+        raise HTTPException(status_code=403, detail="Invalid or expired AKMA key")
+
+    print(f"📡 [AANF] Transaction event stream opened for user ID: {user_id}")
+    return StreamingResponse(
+        stream_transactions(request, user_id, last_event_id if last_event_id is not None else last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ----------------------
 # ✅ AANF LOGOUT
 # ----------------------
@@ -264,7 +323,8 @@ def logout(x_akma_key: str = Header(None), db: Session = Depends(get_db)):
     print(f"🚪 [AANF] Logout Request at {time.strftime('%H:%M:%S')}")
     print(f"🔑 AKID: {x_akma_key}")
     
-    sim_key = db.query(SimKey).filter(SimKey.akid == x_akma_key).first()
+    akid = canonical_hex(x_akma_key)
+    sim_key = db.query(SimKey).filter(SimKey.akid == akid).first() if akid else None
     if sim_key:
         # Mark the key as inactive (logical deletion)
         sim_key.active = 0
@@ -282,13 +342,14 @@ def logout(x_akma_key: str = Header(None), db: Session = Depends(get_db)):
 # ----------------------------
 @router.post("/aanf-internal/get-akma-key")
 async def get_akma_key(akid: str, afid: str, db: Session = Depends(get_db)):
-    """Internal API to simulate AANF server providing key material"""
+    """Internal API to simulate AANF server providing key material (stand-in for AANF_KEY_SERVICE=http)"""
     print("\n" + "="*60)
     print(f"🔒 [AANF-INTERNAL] Key Request at {time.strftime('%H:%M:%S')}")
     print(f"🔑 AKID: {akid}")
     print(f"🏷️ Function: {afid}")
     
-    sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first()
+    akid = canonical_hex(akid)
+    sim_key = db.query(SimKey).filter(SimKey.akid == akid, SimKey.active == 1).first() if akid else None
     if not sim_key:
         print(f"❌ No active SIM key found for AKID: {akid}")
         print("="*60 + "\n")
@@ -1,12 +1,19 @@
 import os
 import time
-from fastapi import APIRouter, HTTPException, Header, Depends
+import datetime
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Depends, Request, Query
+from fastapi.responses import StreamingResponse
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 
 from models.schemas import LoginRequest, OTPRequest, PinRequest, TransactionRequest
 from logic.storage import sessions
-from models.database import get_db, User, Transaction
+from models.database import get_db, SessionLocal, User
+from logic.ledger import record_transaction, query_history
+from logic.velocity import velocity, VelocityViolation
+from logic.events import stream_transactions, issue_stream_ticket, redeem_stream_ticket, STREAM_TICKET_SECONDS
  # Import DB stuff here
 
 router = APIRouter()
@@ -99,15 +106,28 @@ def traditional_transaction(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    # Velocity checks against this user's recent payments
+    check_started = time.perf_counter()
+    try:
+        admitted_at = velocity.admit(user.id, None, req.amount)
+    except VelocityViolation as e:
+        print(f"❌ Transaction REJECTED by velocity check: {e}")
+        print("="*60 + "\n")
+        raise HTTPException(status_code=429, detail=str(e))
+    print(f"🛡️ Velocity check passed in {(time.perf_counter() - check_started) * 1e6:.0f}µs")
+
     # Save transaction in DB
-    transaction = Transaction(
-        user_id=user.id,
-        amount=req.amount,
-        method="Traditional"
-    )
-    db.add(transaction)
-    db.commit()
-    db.refresh(transaction)
+    try:
+        transaction = record_transaction(
+            db,
+            user_id=user.id,
+            amount=req.amount,
+            method="Traditional"
+        )
+    except Exception:
+        # Not saved, so it mustn't count towards the velocity limits
+        velocity.release(user.id, None, req.amount, admitted_at)
+        raise
 
     print(f"✅ Transaction APPROVED | Amount: ₹{req.amount}")
     print("="*60 + "\n")
@@ -146,9 +166,13 @@ def verify_pin(req: PinRequest):
 # ----------------------
 @router.get("/transaction-history")
 def get_transaction_history(
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
     authorization: str = Header(""),
     db: Session = Depends(get_db)
 ):
+    """Ledger entries in [start, end), optionally only the newest `limit`; archived months outside the range are never read"""
     token = authorization.replace("Bearer ", "")
     
     try:
@@ -163,7 +187,7 @@ def get_transaction_history(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    transactions = db.query(Transaction).filter(Transaction.user_id == user.id).all()
+    transactions = query_history(db, user.id, start, end, limit)
     return {
         "transactions": [
             {
@@ -174,3 +198,78 @@ def get_transaction_history(
             for t in transactions
         ]
     }
+
+# ----------------------
+# ✅ Transaction Event Stream
+# ----------------------
+@router.post("/transaction-events/ticket")
+def transaction_events_ticket(
+    authorization: str = Header(""),
+    db: Session = Depends(get_db)
+):
+    """Single-use ticket for opening the event stream from clients that can't send headers"""
+    token = authorization.replace("Bearer ", "")
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        username = payload.get("sub")
+        if username is None:
+            raise HTTPException(status_code=403, detail="Invalid token payload")
+    except JWTError:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    user = db.query(User).filter(User.username == username).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {"ticket": issue_stream_ticket(user.id), "expires_in": STREAM_TICKET_SECONDS}
+
+def _stream_user_id(authorization):
+    """
+    Resolve the stream's user from the Authorization header
+
+    Uses its own short-lived session rather than Depends(get_db): that one would
+    stay checked out for as long as the stream is open.
+    """
+    token = authorization.replace("Bearer ", "")
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        username = payload.get("sub")
+        if username is None:
+            raise HTTPException(status_code=403, detail="Invalid token payload")
+    except JWTError:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user.id
+
+@router.get("/transaction-events")
+async def transaction_events(
+    request: Request,
+    ticket: Optional[str] = None,
+    last_id: Optional[int] = None,
+    authorization: str = Header(""),
+    last_event_id: Optional[int] = Header(None)
+):
+    """Server-sent events for each new transaction; resumes after Last-Event-ID (or last_id)"""
+    if ticket:
+        user_id = redeem_stream_ticket(ticket)
+        if user_id is None:
+            raise HTTPException(status_code=403, detail="Invalid or expired stream ticket")
+    else:
+        # Sync DB work off the event loop
+        user_id = await asyncio.to_thread(_stream_user_id, authorization)
+
+    print(f"📡 [TRADITIONAL] Transaction event stream opened for user ID: {user_id}")
+    return StreamingResponse(
+        stream_transactions(request, user_id, last_event_id if last_event_id is not None else last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )